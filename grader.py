@@ -1,11 +1,17 @@
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, InternalServerError, RateLimitError
 from dotenv import load_dotenv
 from pathlib import Path
 import os
 import pandas as pd
 import json
 import time
-import re
+
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
 # ---------- config ----------
 BASE_DIR = Path(__file__).resolve().parent
@@ -13,6 +19,8 @@ INPUT_CSV = BASE_DIR / "responses" / "llama_Q2_RAG_6.csv"
 OUTPUT_CSV = BASE_DIR / "responses" / "llama_Q2_RAG_6_GRADED.csv"
 REFERENCE_ANSWERS = BASE_DIR /'QA'/ "A2.txt"
 MODEL = "gpt-5"
+BATCH_REQUESTS_FILE = BASE_DIR / "responses" / "grader_batch_requests.jsonl"
+POLL_INTERVAL_SECONDS = 60
 # ----------------------------
 
 GRADING_GUIDELINES = """
@@ -29,17 +37,28 @@ Focus on factual accuracy and completeness, not style or exact wording.
 Be strict but fair.
 """
 
-def safe_parse_json(text):
-    """Extract and parse the first JSON object from the model's text."""
-    text = text.strip()
-    text = text.replace("```json", "").replace("```", "").strip()
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if match:
-        try:
-            return json.loads(match.group(0))
-        except json.JSONDecodeError:
-            pass
-    return None
+# The server enforces this schema on every response, so no regex
+# extraction or re-prompting on malformed JSON is needed
+GRADE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "number", "enum": [0, 0.5, 1]},
+        "explanation": {"type": "string"},
+    },
+    "required": ["score", "explanation"],
+    "additionalProperties": False,
+}
+
+# Retry transient failures (429s/5xx/drops) so one flaky call doesn't
+# abandon an in-flight batch
+provider_retry = retry(
+    wait=wait_random_exponential(1, 60),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type(
+        (RateLimitError, InternalServerError, APIConnectionError)
+    ),
+    reraise=True,
+)
 
 def make_client():
     load_dotenv()
@@ -52,16 +71,14 @@ def load_reference_answers(filepath):
     """Load reference answers from the text file."""
     with open(filepath, 'r', encoding='utf-8') as f:
         content = f.read()
-    
+
     # Split by "A: " and remove the first empty element
     answers = [a.strip() for a in content.split('A: ') if a.strip()]
     return answers
 
-def grade_one_qa(client, question: str, student_answer: str, reference_answer: str) -> tuple[int, str]:
-    """
-    Send one Question+Student Answer+Reference Answer to the model, get back (score, explanation).
-    """
-    prompt = f"""
+def build_grading_prompt(question: str, student_answer: str, reference_answer: str) -> str:
+    """Build the grading prompt for one Question+Student Answer+Reference Answer."""
+    return f"""
 You are an expert grader. Always return ONLY valid JSON – no markdown, no extra text.
 
 Rubric:
@@ -85,84 +102,148 @@ Return a JSON object with exactly these fields:
 Only output valid JSON, nothing else.
 """
 
-    response = client.responses.create(
-        model=MODEL,
-        input=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "input_text", "text": prompt},
-                ],
-            }
-        ],
-    )
-
-    text = response.output_text.strip()
-
-    data = safe_parse_json(text)
-    if data and "score" in data:
-        score = float(data["score"])
-        explanation = str(data.get("explanation", "")).strip()
-    else:
-        score = 0
-        explanation = f"Could not parse model response: {text}"
+def extract_output_text(body: dict) -> str:
+    """Pull the concatenated output text out of a raw /v1/responses body."""
+    chunks = []
+    for item in body.get("output", []):
+        if item.get("type") != "message":
+            continue
+        for part in item.get("content", []):
+            if part.get("type") == "output_text":
+                chunks.append(part.get("text", ""))
+    return "".join(chunks).strip()
 
-    return score, explanation
+def parse_grade(text: str) -> tuple[float, str]:
+    """Turn one schema-constrained model response into (score, explanation)."""
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return 0, f"Could not parse model response: {text}"
+    return float(data["score"]), str(data["explanation"]).strip()
 
 def main():
     client = make_client()
-    
+
     # Load input CSV
     df = pd.read_csv(INPUT_CSV, encoding='utf-8-sig')
-    
+
     if "Q" not in df.columns or "A" not in df.columns:
         raise ValueError("Input CSV must have columns named 'Q' and 'A'.")
-    
+
     # Load reference answers
     reference_answers = load_reference_answers(REFERENCE_ANSWERS)
-    
+
     # Ensure we have the same number of reference answers as questions
     if len(reference_answers) != len(df):
         print(f"Warning: {len(reference_answers)} reference answers but {len(df)} questions in CSV")
         # Pad with empty strings if needed
         while len(reference_answers) < len(df):
             reference_answers.append("")
-    
-    scores = []
-    explanations = []
-
-    for idx, row in df.iterrows():
-        q = str(row["Q"])
-        a = str(row["A"])
-        
-        # Skip empty rows
-        if pd.isna(q) or q.strip() == "" or pd.isna(a) or a.strip() == "":
-            scores.append(0)
-            explanations.append("WRONG. Empty question or answer.")
-            continue
-        
+
+    # Validate the whole frame up front with vectorized column ops instead
+    # of boxing each row through iterrows
+    df["Q"] = df["Q"].fillna("").astype(str).str.strip()
+    df["A"] = df["A"].fillna("").astype(str).str.strip()
+    valid = (df["Q"] != "") & (df["A"] != "")
+
+    # Pre-fill with the "not gradable" sentinel; batch results overwrite per row
+    scores = [0.0] * len(df)
+    explanations = [""] * len(df)
+    for idx in df.index[~valid]:
+        explanations[idx] = "WRONG. Empty question or answer."
+
+    batch_lines = []
+    for idx, q, a in df.loc[valid, ["Q", "A"]].itertuples(index=True, name=None):
         # Get corresponding reference answer
         ref_answer = reference_answers[idx] if idx < len(reference_answers) else ""
-        
+
         if not ref_answer:
-            scores.append(0)
-            explanations.append("WRONG. No reference answer available.")
+            explanations[idx] = "WRONG. No reference answer available."
             continue
-        
-        print(f"Grading row {idx+1}/{len(df)}...")
-        
-        score, explanation = grade_one_qa(client, q, a, ref_answer)
-        scores.append(score)
-        explanations.append(explanation)
-        
-        time.sleep(0.5)
+
+        batch_lines.append({
+            "custom_id": f"row-{idx}",
+            "method": "POST",
+            "url": "/v1/responses",
+            "body": {
+                "model": MODEL,
+                "input": [
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "input_text", "text": build_grading_prompt(q, a, ref_answer)},
+                        ],
+                    }
+                ],
+                "text": {
+                    "format": {
+                        "type": "json_schema",
+                        "name": "grade",
+                        "schema": GRADE_SCHEMA,
+                        "strict": True,
+                    }
+                },
+            },
+        })
+        explanations[idx] = "WRONG. No response returned by batch."
+
+    # The API rejects empty batches; with nothing gradable the sentinel
+    # rows are already final
+    if batch_lines:
+        with open(BATCH_REQUESTS_FILE, "w", encoding="utf-8") as f:
+            for line in batch_lines:
+                f.write(json.dumps(line) + "\n")
+
+        print(f"Submitting batch with {len(batch_lines)} grading requests...")
+
+        files_create = provider_retry(client.files.create)
+        batches_create = provider_retry(client.batches.create)
+        batches_retrieve = provider_retry(client.batches.retrieve)
+        files_content = provider_retry(client.files.content)
+
+        with open(BATCH_REQUESTS_FILE, "rb") as f:
+            batch_input = files_create(file=f, purpose="batch")
+        batch = batches_create(
+            input_file_id=batch_input.id,
+            endpoint="/v1/responses",
+            completion_window="24h",
+        )
+
+        # Poll until the batch reaches a terminal state
+        while True:
+            batch = batches_retrieve(batch.id)
+            counts = batch.request_counts
+            print(f"Batch {batch.id}: {batch.status} "
+                  f"({counts.completed}/{counts.total} completed, {counts.failed} failed)")
+            if batch.status in ("completed", "failed", "expired", "cancelled"):
+                break
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+        if batch.status != "completed" or not batch.output_file_id:
+            raise RuntimeError(f"Batch {batch.id} ended with status '{batch.status}'")
+
+        # Join results back to rows by custom_id
+        output = files_content(batch.output_file_id)
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            idx = int(result["custom_id"].removeprefix("row-"))
+            response = result.get("response")
+            if not response or response.get("status_code") != 200:
+                explanations[idx] = f"WRONG. Batch request failed: {result.get('error')}"
+                continue
+            text = extract_output_text(response["body"])
+            scores[idx], explanations[idx] = parse_grade(text)
+    else:
+        print("No gradable rows; skipping batch submission.")
 
     df["score"] = scores
     df["explanation"] = explanations
 
     df.to_csv(OUTPUT_CSV, index=False, encoding="utf-8-sig")
     print(f"\nSaved scored CSV to: {OUTPUT_CSV}")
-    
+
     # Print summary statistics
     total_score = sum(scores)
     max_score = len([s for s in scores if s >= 0])
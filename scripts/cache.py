@@ -0,0 +1,49 @@
+# cache.py
+"""Tiny on-disk response cache shared by the answering scripts.
+
+All scripts run with temperature=0, so a repeated (model, system prompt,
+user prompt) triple is deterministic and re-issuing the API call just
+burns tokens during dev iterations. Responses are stored in a single
+SQLite key/value table under cache/ keyed by a sha256 of the call
+parameters.
+"""
+import hashlib
+import sqlite3
+from pathlib import Path
+
+CACHE_DB = Path(__file__).resolve().parent.parent / "cache" / "responses.sqlite3"
+
+
+def _connect() -> sqlite3.Connection:
+    CACHE_DB.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(CACHE_DB)
+    conn.execute("CREATE TABLE IF NOT EXISTS kv (k TEXT PRIMARY KEY, v TEXT)")
+    return conn
+
+
+def response_key(*parts) -> str:
+    """Build a cache key from the parameters that determine the response."""
+    joined = "|".join(str(p) for p in parts)
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> str | None:
+    with _connect() as conn:
+        row = conn.execute("SELECT v FROM kv WHERE k = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def put(key: str, value: str) -> None:
+    with _connect() as conn:
+        conn.execute("INSERT OR REPLACE INTO kv (k, v) VALUES (?, ?)", (key, value))
+
+
+def cached_call(key: str, fn):
+    """Return the cached response for key, calling fn() only on a miss."""
+    value = get(key)
+    if value is not None:
+        return value
+    value = fn()
+    if value is not None:
+        put(key, value)
+    return value
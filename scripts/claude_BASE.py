@@ -1,68 +1,116 @@
 import csv
-from openai import OpenAI
+import time
 from dotenv import load_dotenv
-from anthropic import Anthropic
+from anthropic import (
+    Anthropic,
+    APIConnectionError,
+    InternalServerError,
+    RateLimitError,
+)
 from pathlib import Path
 import os
 
+import cache
+from utils import load_questions, provider_retry
+
 # ---------- config ----------
 BASE_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = BASE_DIR.parent
 QUESTIONS_FILE = PROJECT_ROOT / "QA" / "Q2.txt"
 OUTPUT_FILE = PROJECT_ROOT / "responses" / "claude_Q2_BASE_6.csv"
 MODEL = "claude-opus-4-6"
+POLL_INTERVAL_SECONDS = 60
 # -----------------------------
 
 
-SYSTEM_PROMPT = """
-You are an expert acute ischemic stroke answering assistant.
-Follow any instructions given in the user message exactly, especially:
-- Answer directly.
-- Return exactly ONE sentence (no line breaks).
-- Use complete sentences with rationale.
-- Always provide an answer.
-""".strip()
+SYSTEM_PROMPT = "Answer in exactly one sentence with clinical rationale."
 
 def build_prompt(question_text: str) -> str:
     return f"Question: {question_text}".strip()
 
+def extract_text(msg) -> str:
+    # Anthropic returns a list of content blocks; most often the first is text
+    answer = ""
+    for block in msg.content:
+        if getattr(block, "type", None) == "text":
+            answer += block.text
+    return answer.strip()
+
 def main():
     load_dotenv()
     api_key = os.getenv("ANTHROPIC_API_KEY")
     if not api_key:
         raise ValueError("ANTHROPIC_API_KEY not found in .env file")
 
-    client = Anthropic(api_key=api_key)
-
-    with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
-        questions = [
-            line.strip().split(":", 1)[1].strip()
-            if line.lower().startswith("q:")
-            else line.strip()
-            for line in f
-            if line.strip()
-        ]
-
-    rows = []
-    for i, question in enumerate(questions, start=1):
-        print(f"Processing question {i}/{len(questions)}...")
-
-        msg = client.messages.create(
-            model=MODEL,
-            max_tokens=512,
-            temperature=0,
-            system=SYSTEM_PROMPT,
-            messages=[{"role": "user", "content": build_prompt(question)}],
-        )
-
-        # Anthropic returns a list of content blocks; most often the first is text
-        answer = ""
-        for block in msg.content:
-            if getattr(block, "type", None) == "text":
-                answer += block.text
-        answer = answer.strip()
-
-        rows.append([question, answer])
+    client = Anthropic(
+        api_key=api_key,
+        default_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
+    )
+
+    questions = load_questions(QUESTIONS_FILE)
+
+    keys = [cache.response_key(MODEL, SYSTEM_PROMPT, build_prompt(q), 0)
+            for q in questions]
+    answers: list[str | None] = [cache.get(k) for k in keys]
+
+    requests_data = [
+        {
+            "custom_id": f"q-{i}",
+            "params": {
+                "model": MODEL,
+                "max_tokens": 96,
+                "temperature": 0,
+                # Marking the shared system block cacheable lets the server
+                # skip re-prefilling it for every request after the first
+                "system": [
+                    {
+                        "type": "text",
+                        "text": SYSTEM_PROMPT,
+                        "cache_control": {"type": "ephemeral"},
+                    }
+                ],
+                "messages": [{"role": "user", "content": build_prompt(questions[i])}],
+            },
+        }
+        for i, answer in enumerate(answers)
+        if answer is None
+    ]
+
+    # Retry transient failures on the batch lifecycle calls so one flaky
+    # poll doesn't abandon an in-flight batch
+    _retry = provider_retry((RateLimitError, InternalServerError, APIConnectionError))
+    batches_create = _retry(client.messages.batches.create)
+    batches_retrieve = _retry(client.messages.batches.retrieve)
+
+    if requests_data:
+        print(f"Submitting batch with {len(requests_data)} questions "
+              f"({len(questions) - len(requests_data)} cached)...")
+        batch = batches_create(requests=requests_data)
+
+        # Poll until the batch has ended
+        while True:
+            batch = batches_retrieve(batch.id)
+            counts = batch.request_counts
+            print(f"Batch {batch.id}: {batch.processing_status} "
+                  f"({counts.succeeded} succeeded, {counts.errored} errored, "
+                  f"{counts.processing} processing)")
+            if batch.processing_status == "ended":
+                break
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+        for result in client.messages.batches.results(batch.id):
+            i = int(result.custom_id.removeprefix("q-"))
+            if result.result.type == "succeeded":
+                answers[i] = extract_text(result.result.message)
+                cache.put(keys[i], answers[i])
+            else:
+                # Errors are transient; record but don't cache them
+                answers[i] = f"ERROR: {result.result.type}"
+    else:
+        print(f"All {len(questions)} questions served from cache.")
+
+    rows = [[question, answers[i] if answers[i] is not None else "ERROR: missing result"]
+            for i, question in enumerate(questions)]
 
     with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
@@ -73,4 +121,4 @@ def main():
     print(f"Total questions processed: {len(rows)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
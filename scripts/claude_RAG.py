@@ -1,14 +1,21 @@
 # claude_RAG.py
 from dotenv import load_dotenv
 from pathlib import Path
+import asyncio
+import hashlib
+import json
 import os
 import csv
 
+import tiktoken
+
 from llama_index.core import (
     VectorStoreIndex,
-    SimpleDirectoryReader,
     Settings,
     PromptTemplate,
+    QueryBundle,
+    StorageContext,
+    load_index_from_storage,
 )
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.core.node_parser import SentenceSplitter
@@ -19,6 +26,10 @@ from llama_index.core.postprocessor import SentenceTransformerRerank
 from llama_parse import LlamaParse
 
 from llama_index.llms.anthropic import Anthropic
+from anthropic import APIConnectionError, InternalServerError, RateLimitError
+
+import cache
+from utils import CachingParser, load_questions, provider_retry
 
 
 # ---------- config ----------
@@ -26,18 +37,44 @@ BASE_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = BASE_DIR.parent
 QUESTIONS_FILE = PROJECT_ROOT / "QA" / "Q2.txt"
 OUTPUT_FILE = PROJECT_ROOT / "responses" / "claude_Q2_RAG_6.csv"
+DATA_DIR = PROJECT_ROOT / "data"
+PARSED_CACHE_DIR = PROJECT_ROOT / "cache" / "llamaparse"
+INDEX_CACHE_DIR = PROJECT_ROOT / "cache" / "index"
+MANIFEST_FILE = INDEX_CACHE_DIR / "manifest.json"
 MODEL = "claude-opus-4-6"
+# Small first-stage embeddings: the cross-encoder rerank does the fine
+# ranking, so recall is bought with a wider top_k instead of bigger vectors
+EMBED_MODEL = "text-embedding-3-small"
+EMBED_DIMENSIONS = 1536
+SIMILARITY_TOP_K = 40
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_TOP_N = 10
+CONCURRENCY = 8
 # -----------------------------
 
 
-SYSTEM_PROMPT = """
-You are an expert acute ischemic stroke answering assistant.
-Follow any instructions given in the user message exactly, especially:
-- Answer directly.
-- Return exactly ONE sentence (no line breaks).
-- Use complete sentences with rationale.
-- Always provide an answer.
-""".strip()
+SYSTEM_PROMPT = "Answer in exactly one sentence with clinical rationale."
+
+# Resolve the encoding once at import; tiktoken's first lookup is expensive
+# and LlamaIndex would otherwise re-resolve it per component
+_ENC = tiktoken.get_encoding("cl100k_base")
+
+
+_reranker = None
+
+
+def get_reranker() -> SentenceTransformerRerank:
+    """Load the cross-encoder once and reuse it for every query engine."""
+    global _reranker
+    if _reranker is None:
+        import torch
+        torch.set_num_threads(os.cpu_count() or 1)
+        _reranker = SentenceTransformerRerank(model=RERANK_MODEL, top_n=RERANK_TOP_N)
+    return _reranker
+
+
+def file_sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
 
 
 def main():
@@ -58,16 +95,20 @@ def main():
         model=MODEL,
         api_key=anthropic_api_key,
         temperature=0,
+        max_tokens=96,
         system_prompt=SYSTEM_PROMPT,
     )
     embed_model = OpenAIEmbedding(
-        model="text-embedding-3-large",
+        model=EMBED_MODEL,
         api_key=openai_api_key,
-        dimensions=3072,
+        dimensions=EMBED_DIMENSIONS,
+        embed_batch_size=256,
+        num_workers=8,
     )
 
     Settings.llm = llm
     Settings.embed_model = embed_model
+    Settings.tokenizer = _ENC.encode
     Settings.chunk_size = 512
     Settings.chunk_overlap = 128
 
@@ -90,34 +131,51 @@ Question: {query_str}
         ),
     )
 
-    documents = SimpleDirectoryReader(
-        "./data",
-        file_extractor={".pdf": parser},
-    ).load_data()
+    # The persisted index is only valid for this exact corpus and config;
+    # any change to the PDFs, chunking, or embedding model forces a rebuild
+    doc_hashes = {p: file_sha256(p) for p in sorted(DATA_DIR.glob("*.pdf"))}
+    manifest = {
+        "doc_hashes": sorted(doc_hashes.values()),
+        "embed_model": EMBED_MODEL,
+        "dimensions": EMBED_DIMENSIONS,
+        "chunk_size": Settings.chunk_size,
+        "chunk_overlap": Settings.chunk_overlap,
+    }
 
-    node_parser = SentenceSplitter(
-        chunk_size=Settings.chunk_size,
-        chunk_overlap=Settings.chunk_overlap,
-        paragraph_separator="\n\n",
-    )
+    if MANIFEST_FILE.exists() and json.loads(MANIFEST_FILE.read_text(encoding="utf-8")) == manifest:
+        print("Loading index from cache...")
+        storage_context = StorageContext.from_defaults(persist_dir=str(INDEX_CACHE_DIR))
+        index = load_index_from_storage(storage_context)
+    else:
+        caching_parser = CachingParser(parser, PARSED_CACHE_DIR)
+        documents = []
+        for path in sorted(doc_hashes):
+            documents.extend(caching_parser.load_data(path))
 
-    nodes = node_parser.get_nodes_from_documents(documents)
+        node_parser = SentenceSplitter(
+            chunk_size=Settings.chunk_size,
+            chunk_overlap=Settings.chunk_overlap,
+            paragraph_separator="\n\n",
+        )
 
-    index = VectorStoreIndex(nodes)
+        nodes = node_parser.get_nodes_from_documents(documents)
+
+        index = VectorStoreIndex(nodes)
+
+        INDEX_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        index.storage_context.persist(persist_dir=str(INDEX_CACHE_DIR))
+        MANIFEST_FILE.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
 
     retriever = VectorIndexRetriever(
         index=index,
-        similarity_top_k=20,
+        similarity_top_k=SIMILARITY_TOP_K,
     )
 
     query_engine = RetrieverQueryEngine(
         retriever=retriever,
         node_postprocessors=[
             SimilarityPostprocessor(similarity_cutoff=0.25),
-            SentenceTransformerRerank(
-                model="cross-encoder/ms-marco-MiniLM-L-6-v2",
-                top_n=10,
-            ),
+            get_reranker(),
         ],
     )
 
@@ -125,36 +183,82 @@ Question: {query_str}
         "response_synthesizer:text_qa_template": qa_prompt
     })
 
-    def run_query(question: str) -> str:
-        resp = query_engine.query(question)
+    sem = asyncio.Semaphore(CONCURRENCY)
+
+    # Retries are per-call, so a transient Claude failure on one question
+    # never stalls the other in-flight queries
+    aquery_with_retry = provider_retry(
+        (RateLimitError, InternalServerError, APIConnectionError)
+    )(query_engine.aquery)
+
+    # Keying on the corpus manifest invalidates cached answers whenever the
+    # PDFs, chunking, or embedding config change
+    corpus_key = hashlib.sha256(
+        json.dumps(manifest, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+    async def run_query(i: int, total: int, bundle: QueryBundle) -> str:
+        key = cache.response_key(MODEL, SYSTEM_PROMPT, bundle.query_str, 0, corpus_key)
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"Processed question {i}/{total} (cached)...")
+            return cached
+
+        # aquery overlaps vector search and Claude generation across
+        # questions; the semaphore bounds in-flight calls
+        async with sem:
+            resp = await aquery_with_retry(bundle)
+            print(f"Processed question {i}/{total}...")
         text = getattr(resp, "response", None)
-        if isinstance(text, str) and text.strip():
-            return text.strip()
-        return str(resp).strip()
-
-    with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
-        questions = [
-            line.strip().split(":", 1)[1].strip()
-            if line.lower().startswith("q:")
-            else line.strip()
-            for line in f
-            if line.strip()
-        ]
-
-    rows = []
-
-    for i, question in enumerate(questions, start=1):
-        print(f"Processing question {i}/{len(questions)}...")
-        answer = run_query(question)
-        rows.append([question, answer])
-
-    with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["Q", "A"])
-        writer.writerows(rows)
+        answer = text.strip() if isinstance(text, str) and text.strip() else str(resp).strip()
+        cache.put(key, answer)
+        return answer
+
+    async def _run_all(questions: list[str], bundles: list[QueryBundle]) -> None:
+        # Rows must stay in question order but tasks finish out of order;
+        # buffer completed answers and flush the longest in-order prefix so
+        # a crash mid-run keeps the already-answered questions on disk
+        lock = asyncio.Lock()
+        pending: dict[int, str] = {}
+        next_row = 0
+
+        with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as out:
+            writer = csv.writer(out)
+            writer.writerow(["Q", "A"])
+
+            async def write_row(idx: int, answer: str):
+                nonlocal next_row
+                async with lock:
+                    pending[idx] = answer
+                    while next_row in pending:
+                        writer.writerow([questions[next_row], pending.pop(next_row)])
+                        next_row += 1
+                    out.flush()
+
+            async def run_one(idx: int, bundle: QueryBundle):
+                await write_row(idx, await run_query(idx + 1, len(bundles), bundle))
+
+            await asyncio.gather(
+                *[run_one(idx, b) for idx, b in enumerate(bundles)]
+            )
+
+    questions = load_questions(QUESTIONS_FILE)
+
+    # Embed every question in one batched API call; presetting the
+    # embedding on the QueryBundle makes the retriever skip its own
+    # per-query embedding round-trip
+    query_embeddings = embed_model.get_text_embedding_batch(
+        questions, show_progress=True
+    )
+    bundles = [
+        QueryBundle(query_str=q, embedding=e)
+        for q, e in zip(questions, query_embeddings)
+    ]
+
+    asyncio.run(_run_all(questions, bundles))
 
     print(f"\nCSV written to {OUTPUT_FILE}")
-    print(f"Total questions processed: {len(rows)}")
+    print(f"Total questions processed: {len(questions)}")
 
 
 if __name__ == "__main__":
@@ -7,6 +7,9 @@ from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 
+import cache
+from utils import load_questions
+
 # ---------- config ----------
 BASE_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = BASE_DIR.parent
@@ -145,47 +148,50 @@ def main():
 
     client = genai.Client(api_key=api_key)
 
-    with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
-        questions = [
-            line.strip().split(":", 1)[1].strip()
-            if line.lower().startswith("q:")
-            else line.strip()
-            for line in f
-            if line.strip()
-        ]
-
-    rows = []
-
-    for i, question in enumerate(questions, start=1):
-        print(f"Processing question {i}/{len(questions)}.")
-
-        # First pass
-        answer, finish_reason = generate_with_api_retry(client, question, SYSTEM_PROMPT)
-        norm_finish_reason = normalize_finish_reason(finish_reason)
-
-        # Retry if explicit token stop OR if answer visibly looks cut off
-        if norm_finish_reason in {"MAX_TOKENS", "LENGTH"} or looks_truncated(answer):
-            print("  Detected likely truncation; retrying with concise prompt...")
-            concise_answer, concise_finish_reason = generate_with_api_retry(
-                client, question, CONCISE_SYSTEM_PROMPT
-            )
-
-            # Prefer retry if it looks better
-            if concise_answer and not concise_answer.startswith("ERROR"):
-                if not looks_truncated(concise_answer) or looks_truncated(answer):
-                    answer = concise_answer
-
-        answer = answer.replace("\n", " ").strip()
-        rows.append([question, answer])
+    questions = load_questions(QUESTIONS_FILE)
 
+    # Write each row as it completes so a crash mid-run keeps the
+    # already-answered questions on disk
     OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
     with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(["Q", "A"])
-        writer.writerows(rows)
+
+        for i, question in enumerate(questions, start=1):
+            print(f"Processing question {i}/{len(questions)}.")
+
+            key = cache.response_key(MODEL, SYSTEM_PROMPT, build_prompt(question), 0)
+            cached = cache.get(key)
+            if cached is not None:
+                writer.writerow([question, cached])
+                f.flush()
+                continue
+
+            # First pass
+            answer, finish_reason = generate_with_api_retry(client, question, SYSTEM_PROMPT)
+            norm_finish_reason = normalize_finish_reason(finish_reason)
+
+            # Retry if explicit token stop OR if answer visibly looks cut off
+            if norm_finish_reason in {"MAX_TOKENS", "LENGTH"} or looks_truncated(answer):
+                print("  Detected likely truncation; retrying with concise prompt...")
+                concise_answer, concise_finish_reason = generate_with_api_retry(
+                    client, question, CONCISE_SYSTEM_PROMPT
+                )
+
+                # Prefer retry if it looks better
+                if concise_answer and not concise_answer.startswith("ERROR"):
+                    if not looks_truncated(concise_answer) or looks_truncated(answer):
+                        answer = concise_answer
+
+            answer = answer.replace("\n", " ").strip()
+            # Error strings are transient; only cache real answers
+            if answer and not answer.startswith(("ERROR", "[ERROR")):
+                cache.put(key, answer)
+            writer.writerow([question, answer])
+            f.flush()
 
     print(f"\nCSV written to {OUTPUT_FILE}")
-    print(f"Total questions processed: {len(rows)}")
+    print(f"Total questions processed: {len(questions)}")
 
 
 if __name__ == "__main__":
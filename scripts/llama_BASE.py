@@ -1,9 +1,13 @@
+import asyncio
 import csv
-from openai import OpenAI
+from openai import AsyncOpenAI, APIConnectionError, InternalServerError, RateLimitError
 from dotenv import load_dotenv
 from pathlib import Path
 import os
 
+import cache
+from utils import load_questions, provider_retry
+
 # ---------- config ----------
 BASE_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = BASE_DIR.parent
@@ -14,17 +18,19 @@ MODEL = os.getenv("LLAMA_MODEL", "llama3.1:8b")
 
 
 BASE_URL = os.getenv("LLAMA_BASE_URL", "http://localhost:11434/v1")
+
+# Client-side fan-out; for this to help, the Ollama server must also be
+# allowed to run requests in parallel, e.g.:
+#   OLLAMA_NUM_PARALLEL=4       parallel slots per loaded model
+#   OLLAMA_MAX_LOADED_MODELS=1  keep only this model resident in VRAM
+#   OLLAMA_KEEP_ALIVE=30m       keep model + KV state resident between runs
+# The system message is byte-identical and first in every request so
+# llama.cpp can reuse the cached KV prefix across questions.
+CONCURRENCY = int(os.getenv("LLAMA_CONCURRENCY", "4"))
 # -----------------------------
 
 
-SYSTEM_PROMPT = """
-You are an expert acute ischemic stroke answering assistant.
-Follow any instructions given in the user message exactly, especially:
-- Answer directly.
-- Return exactly ONE sentence (no line breaks).
-- Use complete sentences with rationale.
-- Always provide an answer.
-""".strip()
+SYSTEM_PROMPT = "Answer in exactly one sentence with clinical rationale."
 
 
 def build_prompt(question_text: str) -> str:
@@ -38,41 +44,72 @@ def main():
     if not api_key:
         raise ValueError("LLAMA_API_KEY not found in .env file")
 
-    client = OpenAI(api_key=api_key, base_url=BASE_URL)
+    client = AsyncOpenAI(api_key=api_key, base_url=BASE_URL)
 
-    with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
-        questions = [
-            line.strip().split(":", 1)[1].strip()
-            if line.lower().startswith("q:")
-            else line.strip()
-            for line in f
-            if line.strip()
-        ]
+    questions = load_questions(QUESTIONS_FILE)
 
-    rows = []
-    for i, question in enumerate(questions, start=1):
-        print(f"Processing question {i}/{len(questions)}...")
+    sem = asyncio.Semaphore(CONCURRENCY)
 
-        resp = client.chat.completions.create(
+    @provider_retry((RateLimitError, InternalServerError, APIConnectionError))
+    async def ask(prompt: str) -> str:
+        resp = await client.chat.completions.create(
             model=MODEL,
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": build_prompt(question)},
+                {"role": "user", "content": prompt},
             ],
             temperature=0,
-            max_tokens=512,
+            max_tokens=96,
+            stop=["\n\n"],
         )
-
-        answer = (resp.choices[0].message.content or "").strip()
-        rows.append([question, answer])
-
-    with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["Q", "A"])
-        writer.writerows(rows)
+        return (resp.choices[0].message.content or "").strip()
+
+    async def answer_one(i: int, question: str) -> str:
+        prompt = build_prompt(question)
+        key = cache.response_key(MODEL, SYSTEM_PROMPT, prompt, 0)
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"Processing question {i}/{len(questions)} (cached)...")
+            return cached
+
+        async with sem:
+            print(f"Processing question {i}/{len(questions)}...")
+            answer = await ask(prompt)
+        cache.put(key, answer)
+        return answer
+
+    async def _run():
+        # Rows must stay in question order but tasks finish out of order;
+        # buffer completed answers and flush the longest in-order prefix so
+        # a crash mid-run keeps the already-answered questions on disk
+        lock = asyncio.Lock()
+        pending: dict[int, str] = {}
+        next_row = 0
+
+        with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as out:
+            writer = csv.writer(out)
+            writer.writerow(["Q", "A"])
+
+            async def write_row(idx: int, answer: str):
+                nonlocal next_row
+                async with lock:
+                    pending[idx] = answer
+                    while next_row in pending:
+                        writer.writerow([questions[next_row], pending.pop(next_row)])
+                        next_row += 1
+                    out.flush()
+
+            async def run_one(idx: int, question: str):
+                await write_row(idx, await answer_one(idx + 1, question))
+
+            await asyncio.gather(
+                *[run_one(idx, q) for idx, q in enumerate(questions)]
+            )
+
+    asyncio.run(_run())
 
     print(f"\nCSV written to {OUTPUT_FILE}")
-    print(f"Total questions processed: {len(rows)}")
+    print(f"Total questions processed: {len(questions)}")
 
 
 if __name__ == "__main__":
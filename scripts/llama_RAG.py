@@ -20,6 +20,8 @@ from llama_parse import LlamaParse
 from llama_index.llms.ollama import Ollama
 
 
+from utils import CachingParser, load_questions
+
 # ---------- config ----------
 BASE_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = BASE_DIR.parent
@@ -28,14 +30,7 @@ OUTPUT_FILE = PROJECT_ROOT / "responses" / "llama_Q2_RAG_6.csv"
 # -----------------------------
 
 
-SYSTEM_PROMPT = """
-You are an expert acute ischemic stroke answering assistant.
-Follow any instructions given in the user message exactly, especially:
-- Answer directly.
-- Return exactly ONE sentence (no line breaks).
-- Use complete sentences with rationale.
-- Always provide an answer.
-""".strip()
+SYSTEM_PROMPT = "Answer in exactly one sentence with clinical rationale."
 
 
 def main():
@@ -95,7 +90,9 @@ Question: {query_str}
 
     documents = SimpleDirectoryReader(
         "./data",
-        file_extractor={".pdf": parser},
+        file_extractor={
+            ".pdf": CachingParser(parser, PROJECT_ROOT / "cache" / "llamaparse"),
+        },
     ).load_data()
 
     node_parser = SentenceSplitter(
@@ -134,28 +131,22 @@ Question: {query_str}
             return text.strip()
         return str(resp).strip()
 
-    with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
-        questions = [
-            line.strip().split(":", 1)[1].strip()
-            if line.lower().startswith("q:")
-            else line.strip()
-            for line in f
-            if line.strip()
-        ]
-
-    rows = []
-    for i, question in enumerate(questions, start=1):
-        print(f"Processing question {i}/{len(questions)}...")
-        answer = run_query(question)
-        rows.append([question, answer])
+    questions = load_questions(QUESTIONS_FILE)
 
+    # Write each row as it completes so a crash mid-run keeps the
+    # already-answered questions on disk
     with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(["Q", "A"])
-        writer.writerows(rows)
+
+        for i, question in enumerate(questions, start=1):
+            print(f"Processing question {i}/{len(questions)}...")
+            answer = run_query(question)
+            writer.writerow([question, answer])
+            f.flush()
 
     print(f"\nCSV written to {OUTPUT_FILE}")
-    print(f"Total questions processed: {len(rows)}")
+    print(f"Total questions processed: {len(questions)}")
 
 
 if __name__ == "__main__":
@@ -1,9 +1,12 @@
 import csv
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, InternalServerError, RateLimitError
 from dotenv import load_dotenv
 from pathlib import Path
 import os
 
+import cache
+from utils import load_questions, provider_retry
+
 # ---------- config ----------
 BASE_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = BASE_DIR.parent
@@ -13,14 +16,7 @@ MODEL = "gpt-5"
 # -----------------------------
 
 
-SYSTEM_PROMPT = """
-You are an expert acute ischemic stroke answering assistant.
-Follow any instructions given in the user message exactly, especially:
-- Answer directly.
-- Answer in one sentence.
-- Use complete sentences with rationale.
-- Always provide an answer.
-""".strip()
+SYSTEM_PROMPT = "Answer in exactly one sentence with clinical rationale."
 
 def build_prompt(question_text):
     """
@@ -41,20 +37,10 @@ def main():
 
     client = OpenAI(api_key=api_key)
 
-    with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
-        questions = [
-            line.strip().split(":", 1)[1].strip()
-            if line.lower().startswith("q:")
-            else line.strip()
-            for line in f
-            if line.strip()
-        ]
-
-    rows = []
-
-    for i, question in enumerate(questions, start=1):
-        print(f"Processing question {i}/{len(questions)}...")
+    questions = load_questions(QUESTIONS_FILE)
 
+    @provider_retry((RateLimitError, InternalServerError, APIConnectionError))
+    def ask(prompt: str) -> str:
         response = client.responses.create(
             model=MODEL,
             input=[
@@ -64,21 +50,33 @@ def main():
                 },
                 {
                     "role": "user",
-                    "content": [{"type": "input_text", "text": build_prompt(question)}],
+                    "content": [{"type": "input_text", "text": prompt}],
                 },
             ],
+            # Reasoning tokens count against max_output_tokens; without
+            # minimal effort the budget is spent before any visible text
+            reasoning={"effort": "minimal"},
+            max_output_tokens=96,
         )
+        return response.output_text.strip()
 
-        answer = response.output_text.strip()
-        rows.append([question, answer])
-
+    # Write each row as it completes so a crash mid-run keeps the
+    # already-answered questions on disk
     with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(["Q", "A"])
-        writer.writerows(rows)
+
+        for i, question in enumerate(questions, start=1):
+            print(f"Processing question {i}/{len(questions)}...")
+
+            prompt = build_prompt(question)
+            key = cache.response_key(MODEL, SYSTEM_PROMPT, prompt, 0)
+            answer = cache.cached_call(key, lambda: ask(prompt))
+            writer.writerow([question, answer])
+            f.flush()
 
     print(f"\nCSV written to {OUTPUT_FILE}")
-    print(f"Total questions processed: {len(rows)}")
+    print(f"Total questions processed: {len(questions)}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+# utils.py
+"""Helpers shared by the answering scripts."""
+import hashlib
+import re
+from pathlib import Path
+
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+# One question per line, with an optional leading "Q:" (any case) to strip;
+# the lazy group leaves trailing whitespace to \s*$ and matches empty on
+# blank or bare "Q:" lines so the caller can filter them out
+_QUESTION_RE = re.compile(r"^\s*(?:[Qq]\s*:\s*)?(.*?)\s*$")
+
+
+def provider_retry(exceptions):
+    """Build a retry decorator for transient provider failures (429s/5xx).
+
+    Works on sync and async callables alike; each concurrent call retries
+    independently, so one flaky request never stalls the rest of a run.
+    """
+    return retry(
+        wait=wait_random_exponential(1, 60),
+        stop=stop_after_attempt(6),
+        retry=retry_if_exception_type(exceptions),
+        reraise=True,
+    )
+
+
+def load_questions(path) -> list[str]:
+    """Load the questions from a QA file, one per line, skipping blanks."""
+    return [
+        m.group(1)
+        for line in Path(path).read_text(encoding="utf-8").splitlines()
+        if (m := _QUESTION_RE.match(line)) and m.group(1)
+    ]
+
+
+class CachingParser:
+    """File extractor that caches LlamaParse markdown by file content hash.
+
+    LlamaParse is a remote, paid, high-latency parser; an unchanged PDF is
+    never re-sent. Cache entries also key on the parser config, so changing
+    the result type or parsing instruction re-parses.
+    """
+
+    def __init__(self, parser, cache_dir):
+        self.parser = parser
+        self.cache_dir = Path(cache_dir)
+        config = f"{getattr(parser, 'result_type', '')}|{getattr(parser, 'parsing_instruction', '')}"
+        self._config_hash = hashlib.sha256(config.encode("utf-8")).hexdigest()[:12]
+
+    def load_data(self, file_path, extra_info=None, **kwargs):
+        # Imported here so the BASE scripts can use utils without llama-index
+        from llama_index.core import Document
+
+        path = Path(file_path)
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        cached = self.cache_dir / f"{digest}-{self._config_hash}.md"
+        if cached.exists():
+            return [Document(
+                text=cached.read_text(encoding="utf-8"),
+                metadata={"file_name": path.name},
+            )]
+
+        print(f"Parsing {path.name} with LlamaParse...")
+        docs = self.parser.load_data(str(path), extra_info=extra_info, **kwargs)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        cached.write_text("\n\n".join(d.text for d in docs), encoding="utf-8")
+        return docs